@@ -1,126 +1,474 @@
+import argparse
+import functools
+import io
+import logging
 import psycopg2
 import requests
 import yaml
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from operator import itemgetter
 from tqdm import tqdm
-from psycopg2.extras import execute_values
-from datetime import datetime
+try:
+    from psycopg2.extras import execute_values
+except ImportError:  # psycopg2 < 2.7 has no execute_values
+    execute_values = None
+try:
+    import orjson
+except ImportError:  # optional: faster JSON decoding of API responses
+    orjson = None
+try:
+    import requests_cache
+except ImportError:  # optional: on-disk cache of beer details between runs
+    requests_cache = None
+from datetime import timedelta, timezone
+from email.utils import parsedate_to_datetime
 
-# Load configuration from YAML file
+# Per-request messages go to this logger at DEBUG so they stay off the console by default
+logger = logging.getLogger(__name__)
+
+# Beers buffered before they are written and committed. At the API budget a full batch takes about
+# two hours to fetch, so a batch is also flushed once it has been filling for BATCH_SECONDS.
+BATCH_SIZE = 200
+BATCH_SECONDS = 300
+
+# Batches at least this large are loaded with COPY instead of a multi-row INSERT. Only full
+# batches qualify, and those mostly come from warm runs served by the detail cache.
+COPY_THRESHOLD = BATCH_SIZE
+
+# Columns written for each brewery, in the order brewery_row() produces them; brewery_id is the conflict target
+BREWERY_COLUMNS = (
+    "brewery_id", "name", "slug", "brewery_type", "page_url", "label",
+    "country", "city", "state", "latitude", "longitude", "description", "website",
+)
+BREWERY_TEMPLATE = "(" + ", ".join("%s" for column in BREWERY_COLUMNS) + ")"
+BREWERY_UPSERT_SQL = (
+    f"INSERT INTO breweries ({', '.join(BREWERY_COLUMNS)}) VALUES %s "
+    "ON CONFLICT (brewery_id) DO UPDATE SET "
+    + ", ".join(f"{column} = EXCLUDED.{column}" for column in BREWERY_COLUMNS[1:])
+)
+
+# Columns written for each beer, in the order beer_row() produces them; beer_id is the conflict target
+BEER_COLUMNS = (
+    "beer_id", "name", "label", "label_hd", "abv", "ibu", "style", "description", "slug",
+    "rating_count", "rating_score", "weighted_rating_score",
+    "total_count", "monthly_count", "total_user_count", "user_count",
+    "brewery_id", "created_at", "is_in_production", "is_homebrew", "active",
+)
+# The API sends flags as 0/1; Postgres turns them into booleans (COPY accepts 0/1 as is)
+BEER_BOOLEAN_COLUMNS = {"is_in_production", "is_homebrew", "active"}
+BEER_TEMPLATE = "(" + ", ".join(
+    "%s::boolean" if column in BEER_BOOLEAN_COLUMNS else "%s" for column in BEER_COLUMNS
+) + ")"
+BEER_UPSERT_SQL = (
+    f"INSERT INTO beers ({', '.join(BEER_COLUMNS)}) VALUES %s "
+    "ON CONFLICT (beer_id) DO UPDATE SET "
+    + ", ".join(f"{column} = EXCLUDED.{column}" for column in BEER_COLUMNS[1:])
+)
+
+# Pull the directly-copied beer fields out of a /beer/info response in one call each
+BEER_FIELDS = itemgetter(
+    "bid", "beer_name", "beer_label", "beer_label_hd", "beer_abv", "beer_ibu", "beer_style",
+    "beer_description", "beer_slug", "rating_count", "rating_score", "weighted_rating_score",
+)
+STATS_FIELDS = itemgetter("total_count", "monthly_count", "total_user_count", "user_count")
+
+# Number of beer detail requests allowed in flight at once
+MAX_WORKERS = 8
+
+# Rated beers requested per page (the API default is 25, the maximum 50); pages are fetched this many at a time
+PAGE_SIZE = 50
+PAGE_WORKERS = 4
+
+# Untappd API quota: requests allowed per rolling hour. The limiter budgets a few less so
+# clock drift or a request from another client doesn't tip us into 429s.
+RATE_LIMIT_PER_HOUR = 100
+RATE_LIMIT_HEADROOM = 5
+RATE_LIMIT_WINDOW = 3600  # seconds to wait for the quota to reset when the API doesn't say
+
+# Connection pooling plus retries: connection errors and transient 5xx responses are retried
+# with exponential backoff. 429s are left to api_get, which waits for the quota to reset.
+def api_adapter():
+    retry = Retry(
+        total=8,
+        backoff_factor=1.0,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+    )
+    return HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32)
+
+# Shared HTTP session so connections to the API are kept alive and pooled
+SESSION = requests.Session()
+SESSION.mount("https://", api_adapter())
+
+# Beer details barely change hour to hour, so cache them on disk for a day when requests-cache
+# is installed. Credentials are left out of the cache key (and the stored responses).
+if requests_cache is None:
+    DETAILS_SESSION = SESSION
+else:
+    DETAILS_SESSION = requests_cache.CachedSession(
+        "untappd_cache",
+        backend="sqlite",
+        expire_after=86400,
+        allowable_methods=("GET",),
+        allowable_codes=(200,),  # never replay a 404 or an error page on the next run
+        ignored_parameters=("client_id", "client_secret"),
+    )
+    DETAILS_SESSION.mount("https://", api_adapter())
+
+# Thread-safe token bucket: caps the sustained request rate but allows bursts up to capacity.
+# It also tracks the quota the API reports, and holds every request once that is down to the
+# reserve, until the quota resets.
+class TokenBucket:
+    def __init__(self, rate, capacity, reserve=0):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.reserve = reserve  # API quota to leave unused
+        # Until the API reports what is left of the quota, allow a single request to find out
+        self.tokens = 1
+        self.synced = False
+        self.updated_at = time.monotonic()
+        self.resume_at = 0.0  # monotonic time before which no request may be sent
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    # Stop sending for the given number of seconds. The quota is full again afterwards, so the
+    # bucket re-syncs from the first response after the hold.
+    def _hold(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+        self.tokens = 1
+        self.updated_at = self.resume_at
+        self.synced = False
+
+    def hold(self, seconds):
+        with self.lock:
+            self._hold(seconds)
+
+    # Block until a token is available, then take it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    wait = self.resume_at - now
+                else:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            # Wake up now and then: a sync can hand out the whole quota at once
+            time.sleep(min(wait, 5))
+
+    # Match the bucket to the quota the API reports: the first report sets it, later ones can only
+    # lower it. Once no more than the reserve is left, hold until the quota resets.
+    def sync(self, remaining, reset_after):
+        if remaining is None:
+            return
+        with self.lock:
+            if time.monotonic() < self.resume_at:
+                return  # already holding until the reset
+            self._refill()
+            available = float(remaining) - self.reserve
+            if self.synced:
+                self.tokens = min(self.tokens, available)
+            else:
+                self.tokens = min(self.capacity, available)
+                self.synced = True
+            if available <= 0:
+                self._hold(reset_after)
+
+API_BUDGET_PER_HOUR = RATE_LIMIT_PER_HOUR - RATE_LIMIT_HEADROOM
+API_LIMITER = TokenBucket(
+    rate=API_BUDGET_PER_HOUR / 3600, capacity=API_BUDGET_PER_HOUR, reserve=RATE_LIMIT_HEADROOM
+)
+
+# Load configuration from YAML file (parsed once per process, with libyaml when available)
+@functools.lru_cache(maxsize=1)
 def load_config(filepath="config.yaml"):
     try:
         with open(filepath, "r") as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     except Exception as e:
         print(f"Error loading config: {e}")
         raise
 
-# Fetch all rated beers from the API, handling pagination
-def fetch_rated_beers(api_config):
-    print("Fetching rated beers...")
-    url = f"{api_config['base_url']}/user/beers/{api_config['username']}"
-    params = {
+# Decode a JSON API response, with orjson when it is installed
+def parse_json(response):
+    if orjson is None:
+        return response.json()
+    return orjson.loads(response.content)
+
+# Send the API credentials with every request made through the shared sessions
+def configure_sessions(api_config):
+    credentials = {
         "client_id": api_config["client_id"],
         "client_secret": api_config["client_secret"],
     }
-    all_beers = []
-    offset = 0
+    SESSION.params.update(credentials)
+    DETAILS_SESSION.params.update(credentials)
 
-    while True:
-        params["offset"] = offset
-        response = requests.get(url, params=params)
-        print(f"Fetching beers with offset {offset}... Response: {response.status_code}")
-        if response.status_code == 429:
-            print("Rate limit reached. Waiting for 60 seconds...")
-            time.sleep(60)
-            continue
+# Seconds until the API quota resets, from X-Ratelimit-Reset (either a delay or a Unix timestamp)
+# when the API sends it, otherwise a full window
+def quota_reset_seconds(response):
+    try:
+        reset = float(response.headers["X-Ratelimit-Reset"])
+    except (KeyError, ValueError):
+        return RATE_LIMIT_WINDOW
+    if reset > RATE_LIMIT_WINDOW * 24:  # too far off for a delay, so it's a timestamp
+        reset -= time.time()
+    return min(max(reset, 1), RATE_LIMIT_WINDOW)
 
-        response.raise_for_status()
+# Issue a rate-limited GET against the API (the session adapter retries 5xx errors). A 429 puts
+# the limiter on hold until the quota resets, then the request is retried through it.
+def api_get(url, params=None, session=SESSION):
+    # Cache hits don't count against the quota, so serve them without taking a token
+    if requests_cache is not None and isinstance(session, requests_cache.CachedSession):
+        response = session.get(url, params=params, only_if_cached=True)
+        if response.status_code != 504:  # 504 is how requests-cache reports a miss
+            return response
 
-        data = response.json()
-        beers = data["response"]["beers"]["items"]
-        all_beers.extend(beers)
+    while True:
+        API_LIMITER.acquire()
+        response = session.get(url, params=params)
+        if response.status_code != 429:
+            API_LIMITER.sync(response.headers.get("X-Ratelimit-Remaining"), quota_reset_seconds(response))
+            return response
+        wait = quota_reset_seconds(response)
+        logger.warning("Rate limit reached. Waiting %d seconds for the quota to reset...", wait)
+        API_LIMITER.hold(wait)
 
-        # Check if there are more beers to fetch
-        if len(beers) < 25:  # Default page size is 25; if less, we've reached the end
-            break
+# Fetch one page of a user's rated beers
+def fetch_rated_beers_page(url, offset):
+    response = api_get(url, {"offset": offset, "limit": PAGE_SIZE})
+    logger.debug("Fetching beers with offset %s... Response: %s", offset, response.status_code)
+    response.raise_for_status()
+    return parse_json(response)["response"]
 
-        offset += 25  # Move to the next page
+# Fetch all rated beers from the API, handling pagination
+def fetch_rated_beers(api_config):
+    print("Fetching rated beers...")
+    url = f"{api_config['base_url']}/user/beers/{api_config['username']}"
+    first_page = fetch_rated_beers_page(url, 0)
+    beers = first_page["beers"]["items"]
+    all_beers = list(beers)
+    total = first_page.get("total_count")
+
+    if total is not None:
+        # The first page tells us how many beers there are, so fetch the rest concurrently
+        offsets = range(PAGE_SIZE, total, PAGE_SIZE)
+        with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+            for page in executor.map(lambda offset: fetch_rated_beers_page(url, offset), offsets):
+                all_beers.extend(page["beers"]["items"])
+    else:
+        offset = 0
+        # A short page means we've reached the end
+        while len(beers) >= PAGE_SIZE:
+            offset += PAGE_SIZE
+            beers = fetch_rated_beers_page(url, offset)["beers"]["items"]
+            all_beers.extend(beers)
 
     print(f"Total beers fetched: {len(all_beers)}")
     return all_beers
 
 # Fetch detailed beer information by beer_id
-def fetch_beer_details(api_config, beer_id):
-    url = f"{api_config['base_url']}/beer/info/{beer_id}"
-    params = {
-        "client_id": api_config["client_id"],
-        "client_secret": api_config["client_secret"],
-    }
+def fetch_beer_details(base_url, beer_id):
+    response = api_get(f"{base_url}/beer/info/{beer_id}", session=DETAILS_SESSION)
+    logger.debug("Fetching details for beer_id %s... Response: %s", beer_id, response.status_code)
+    response.raise_for_status()
+    return parse_json(response)
 
-    while True:
-        response = requests.get(url, params=params)
-        print(f"Fetching details for beer_id {beer_id}... Response: {response.status_code}")
-        
-        if response.status_code == 429:  # Handle rate limiting
-            print("Rate limit reached. Waiting for 60 seconds...")
-            time.sleep(60)
-            continue
-
-        response.raise_for_status()
-        return response.json()
+# Fetch details for many beers concurrently, yielding (beer_id, response) pairs as they complete.
+# A beer whose fetch fails is logged and yielded with a None response.
+def fetch_all_beer_details(api_config, beer_ids):
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        base_url = api_config["base_url"]
+        futures = {executor.submit(fetch_beer_details, base_url, beer_id): beer_id for beer_id in beer_ids}
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                # Skip this beer rather than losing the whole batch; the next run fetches it again
+                logger.warning("Error fetching beer_id %s: %s", futures[future], e)
+                response = None
+            yield futures[future], response
+    finally:
+        # Stop fetching beers nobody is waiting for any more
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Parse an API timestamp ("Sat, 21 Aug 2010 07:33:46 +0000") into an aware UTC datetime
+def parse_api_timestamp(value):
+    if not value:
+        return None
+    parsed = parsedate_to_datetime(value)
+    if parsed.tzinfo is None:  # "-0000" means UTC with no stated zone
+        return parsed.replace(tzinfo=timezone.utc)
+    if parsed.utcoffset() != timedelta(0):
+        return parsed.astimezone(timezone.utc)
+    return parsed
 
-# Insert or update brewery details
-def upsert_brewery(cursor, brewery_details):
-    query = """
-    INSERT INTO breweries (
-        brewery_id, name, slug, brewery_type, page_url, label,
-        country, city, state, latitude, longitude, description, website
-    ) VALUES (
-        %(brewery_id)s, %(name)s, %(slug)s, %(brewery_type)s, %(page_url)s, %(label)s,
-        %(country)s, %(city)s, %(state)s, %(latitude)s, %(longitude)s, %(description)s, %(website)s
+# Look up every stored beer from the given list in one query: {beer_id: (rating_count, rating_score)}.
+# A named (server-side) cursor streams the rows in chunks instead of materialising them all at once.
+def fetch_existing_beers(connection, beer_ids):
+    with connection.cursor(name="existing_beers") as cursor:
+        cursor.itersize = 2000
+        cursor.execute(
+            "SELECT beer_id, rating_count, rating_score FROM beers WHERE beer_id = ANY(%s);",
+            (beer_ids,),
+        )
+        return {beer_id: (rating_count, rating_score) for beer_id, rating_count, rating_score in cursor}
+
+# Return which of the given brewery_ids are already stored
+def fetch_existing_brewery_ids(connection, brewery_ids):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT brewery_id FROM breweries WHERE brewery_id = ANY(%s);", (brewery_ids,))
+        return {brewery_id for brewery_id, in cursor}
+
+# A listed beer needs its details fetched unless its stored rating stats still match the listing
+def needs_refresh(beer, stored):
+    rating_count = beer.get("rating_count")
+    rating_score = beer.get("rating_score")
+    if stored is None or rating_count is None or rating_score is None:
+        return True
+    stored_count, stored_score = stored
+    return (
+        stored_count != rating_count
+        or stored_score is None
+        or float(stored_score) != float(rating_score)
+    )
+
+# Build a brewery row tuple, in BREWERY_COLUMNS order, from the brewery part of a /beer/info response
+def brewery_row(brewery_details):
+    location = brewery_details["location"]
+    return (
+        brewery_details["brewery_id"],
+        brewery_details["brewery_name"],
+        brewery_details["brewery_slug"],
+        brewery_details["brewery_type"],
+        brewery_details.get("brewery_page_url", ""),
+        brewery_details.get("brewery_label", ""),
+        brewery_details["country_name"],
+        location["brewery_city"],
+        location["brewery_state"],
+        location.get("lat"),
+        location.get("lng"),
+        brewery_details.get("brewery_description", ""),
+        brewery_details["contact"].get("url", ""),
+    )
+
+# Insert or update a batch of breweries in a single multi-row statement.
+# Rows must have distinct brewery_ids: ON CONFLICT can't update the same row twice in one statement.
+def upsert_breweries(cursor, rows):
+    if execute_values is None:
+        mogrify_values(cursor, BREWERY_UPSERT_SQL, rows, BREWERY_TEMPLATE)
+    else:
+        execute_values(cursor, BREWERY_UPSERT_SQL, rows, template=BREWERY_TEMPLATE, page_size=BATCH_SIZE)
+
+# Build a beer row tuple, in BEER_COLUMNS order, from a /beer/info response
+def beer_row(beer_details):
+    return (
+        BEER_FIELDS(beer_details)
+        + STATS_FIELDS(beer_details["stats"])
+        + (
+            beer_details["brewery"]["brewery_id"],
+            parse_api_timestamp(beer_details["created_at"]),
+            beer_details.get("is_in_production", 0),
+            beer_details.get("is_homebrew", 0),
+            beer_details.get("beer_active", 0),
+        )
     )
-    ON CONFLICT (brewery_id) DO UPDATE SET
-        name = EXCLUDED.name,
-        slug = EXCLUDED.slug,
-        brewery_type = EXCLUDED.brewery_type,
-        page_url = EXCLUDED.page_url,
-        label = EXCLUDED.label,
-        country = EXCLUDED.country,
-        city = EXCLUDED.city,
-        state = EXCLUDED.state,
-        latitude = EXCLUDED.latitude,
-        longitude = EXCLUDED.longitude,
-        description = EXCLUDED.description,
-        website = EXCLUDED.website;
-    """
-    brewery_data = {
-        "brewery_id": brewery_details["brewery_id"],
-        "name": brewery_details["brewery_name"],
-        "slug": brewery_details["brewery_slug"],
-        "brewery_type": brewery_details["brewery_type"],
-        "page_url": brewery_details.get("brewery_page_url", ""),  
-        "label": brewery_details.get("brewery_label", ""),
-        "country": brewery_details["country_name"],
-        "city": brewery_details["location"]["brewery_city"],
-        "state": brewery_details["location"]["brewery_state"],
-        "latitude": brewery_details["location"].get("lat", None),
-        "longitude": brewery_details["location"].get("lng", None),
-        "description": brewery_details.get("brewery_description", ""),
-        "website": brewery_details["contact"].get("url", ""),
-    }
-    cursor.execute(query, brewery_data)
 
-# Main function to process beers and breweries
-def main():
+# Fallback for execute_values: mogrify every row and send one multi-row VALUES literal
+def mogrify_values(cursor, query, rows, template):
+    values = b",".join(cursor.mogrify(template, row) for row in rows)
+    cursor.execute(query.encode().replace(b"%s", values, 1))
+
+# Insert or update a batch of beers in a single multi-row statement
+def upsert_beers(cursor, rows):
+    if execute_values is None:
+        mogrify_values(cursor, BEER_UPSERT_SQL, rows, BEER_TEMPLATE)
+    else:
+        execute_values(cursor, BEER_UPSERT_SQL, rows, template=BEER_TEMPLATE, page_size=BATCH_SIZE)
+
+# Format a value for COPY's text format
+def copy_text(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+# Bulk upsert for large batches: COPY rows into a temp staging table, then merge set-based.
+# The first column is the conflict target. The staging table is dropped on commit, so call
+# this at most once per table per transaction.
+def copy_upsert(cursor, table, columns, rows):
+    column_list = ", ".join(columns)
+    update_set = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_text(value) for value in row) + "\n")
+    buffer.seek(0)
+
+    cursor.execute(f"CREATE TEMP TABLE {table}_stage (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    cursor.copy_expert(f"COPY {table}_stage ({column_list}) FROM STDIN WITH (FORMAT text)", buffer)
+    cursor.execute(f"""
+    INSERT INTO {table} ({column_list})
+    SELECT {column_list} FROM {table}_stage
+    ON CONFLICT ({columns[0]}) DO UPDATE SET {update_set};
+    """)
+
+# Write a batch of breweries, using COPY once the batch is large enough to pay for it
+def write_breweries(cursor, rows):
+    if len(rows) >= COPY_THRESHOLD:
+        copy_upsert(cursor, "breweries", BREWERY_COLUMNS, rows)
+    else:
+        upsert_breweries(cursor, rows)
+
+# Write a batch of beers, using COPY once the batch is large enough to pay for it
+def write_beers(cursor, rows):
+    if len(rows) >= COPY_THRESHOLD:
+        copy_upsert(cursor, "beers", BEER_COLUMNS, rows)
+    else:
+        upsert_beers(cursor, rows)
+
+# Write a batch of breweries and the beers that reference them, then commit
+def commit_batch(connection, cursor, brewery_rows, beer_rows):
+    if brewery_rows:
+        write_breweries(cursor, brewery_rows)
+    if beer_rows:
+        write_beers(cursor, beer_rows)
+    connection.commit()
+
+# Main function to process beers and breweries. Beers and breweries that are already stored
+# (and, for beers, whose rating stats are unchanged) are skipped unless force_refresh is set.
+def main(force_refresh=False):
+    logging.basicConfig(level=logging.INFO)
     print("Starting the script...")
     # Load configuration
     config = load_config()
+    configure_sessions(config["api"])
 
     # Connect to the database
     print("Connecting to database...")
     try:
         connection = psycopg2.connect(**config["database"])
+        connection.autocommit = False  # writes are grouped into BATCH_SIZE transactions
         print("Connected to database successfully.")
     except Exception as e:
         print(f"Database connection failed: {e}")
@@ -131,46 +479,67 @@ def main():
     try:
         # Fetch user-rated beers
         rated_beers = fetch_rated_beers(config["api"])
+        brewery_rows = []
+        beer_rows = []
+
+        # A beer can show up on two pages if the list shifts while pages are fetched concurrently.
+        # Keep one entry per beer_id: ON CONFLICT can't update the same row twice in one statement.
+        listed_beers = {rated_beer["beer"]["bid"]: rated_beer["beer"] for rated_beer in rated_beers}
+
+        if force_refresh:
+            beer_ids = list(listed_beers)
+            known_breweries = set()
+            seed_run = True
+        else:
+            # Only fetch details for beers that are new or whose rating stats have moved
+            existing = fetch_existing_beers(connection, list(listed_beers))
+            beer_ids = [
+                beer_id for beer_id, beer in listed_beers.items() if needs_refresh(beer, existing.get(beer_id))
+            ]
+            print(f"Skipping {len(listed_beers) - len(beer_ids)} unchanged beers.")
+            seed_run = not existing
+
+            # Breweries already stored don't need rewriting
+            known_breweries = fetch_existing_brewery_ids(connection, list({
+                rated_beer["brewery"]["brewery_id"] for rated_beer in rated_beers if "brewery" in rated_beer
+            }))
 
-        # Use tqdm for progress tracking
-        for rated_beer in tqdm(rated_beers, desc="Processing Beers"):
-            beer_id = rated_beer["beer"]["bid"]
+            # End the read-only transaction now rather than leaving it idle (holding its snapshot)
+            # through the rate-limited fetches before the first batch commit
+            connection.commit()
 
-            # Fetch beer details
-            beer_details = fetch_beer_details(config["api"], beer_id)["response"]["beer"]
+        # For a seed run (--force-refresh, or nothing stored yet), don't wait for the WAL flush on
+        # each batch commit. A crash may lose the last few batches, which the next run fetches again,
+        # but cannot corrupt the tables. Incremental runs keep full durability. Committed right away
+        # so a later rollback doesn't undo the setting.
+        if seed_run:
+            cursor.execute("SET synchronous_commit TO off;")
+            connection.commit()
 
-            # Upsert brewery details
+        # Fetch beer details concurrently, using tqdm for progress tracking
+        batch_started = time.monotonic()
+        beer_responses = fetch_all_beer_details(config["api"], beer_ids)
+        for beer_id, response in tqdm(beer_responses, total=len(beer_ids), desc="Processing Beers"):
+            if response is None:
+                continue
+            beer_details = response["response"]["beer"]
+
+            # Prepare brewery data, once per brewery per run, and beer data
             brewery_details = beer_details["brewery"]
-            upsert_brewery(cursor, brewery_details)
-
-            # Prepare beer data
-            beer_data = {
-                "beer_id": beer_details["bid"],
-                "name": beer_details["beer_name"],
-                "label": beer_details["beer_label"],
-                "label_hd": beer_details["beer_label_hd"],
-                "abv": beer_details["beer_abv"],
-                "ibu": beer_details["beer_ibu"],
-                "style": beer_details["beer_style"],
-                "description": beer_details["beer_description"],
-                "is_in_production": bool(beer_details["is_in_production"]),
-                "is_homebrew": bool(beer_details["is_homebrew"]),
-                "slug": beer_details["beer_slug"],
-                "created_at": beer_details["created_at"],
-                "rating_count": beer_details["rating_count"],
-                "rating_score": beer_details["rating_score"],
-                "total_count": beer_details["stats"]["total_count"],
-                "monthly_count": beer_details["stats"]["monthly_count"],
-                "total_user_count": beer_details["stats"]["total_user_count"],
-                "user_count": beer_details["stats"]["user_count"],
-                "weighted_rating_score": beer_details["weighted_rating_score"],
-                "active": bool(beer_details["beer_active"]),
-            }
-
-            # Insert or update beer record
-            # Your existing logic for beer upsert should go here
-
-            connection.commit()  # Commit after processing each beer
+            if brewery_details["brewery_id"] not in known_breweries:
+                known_breweries.add(brewery_details["brewery_id"])
+                brewery_rows.append(brewery_row(brewery_details))
+            beer_rows.append(beer_row(beer_details))
+
+            # Write and commit in batches rather than one round-trip per beer, without letting
+            # fetched rows sit uncommitted for long while the rate limit paces the fetches
+            if len(beer_rows) >= BATCH_SIZE or time.monotonic() - batch_started >= BATCH_SECONDS:
+                commit_batch(connection, cursor, brewery_rows, beer_rows)
+                brewery_rows = []
+                beer_rows = []
+                batch_started = time.monotonic()
+
+        commit_batch(connection, cursor, brewery_rows, beer_rows)
 
         print("Beer and brewery data updated successfully!")
 
@@ -182,7 +551,13 @@ def main():
         connection.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store details of a user's rated beers and their breweries.")
+    parser.add_argument(
+        "--force-refresh", action="store_true",
+        help="re-fetch and rewrite every rated beer and brewery, even if already stored",
+    )
+    args = parser.parse_args()
     try:
-        main()
+        main(force_refresh=args.force_refresh)
     except Exception as e:
         print(f"Unexpected error: {e}")
\ No newline at end of file
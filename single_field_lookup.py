@@ -1,74 +1,87 @@
-import time
+import logging
 import psycopg2
-import requests
-import yaml
 from tqdm import tqdm
+# execute_values is None on psycopg2 < 2.7; beer_database guards the import and provides the fallback
+from beer_database import configure_sessions, execute_values, fetch_all_beer_details, load_config, mogrify_values
 
-# Load configuration from YAML file
-def load_config(filepath="config.yaml"):
-    with open(filepath, "r") as file:
-        return yaml.safe_load(file)
+logger = logging.getLogger(__name__)
 
-# Fetch beer details from the Untappd API
-def fetch_beer_details(api_config, beer_id):
-    url = f"{api_config['base_url']}/beer/info/{beer_id}"
-    params = {
-        "client_id": api_config["client_id"],
-        "client_secret": api_config["client_secret"],
-    }
-    while True:
-        response = requests.get(url, params=params)
-        if response.status_code == 429:  # Rate limit exceeded
-            print("Rate limit reached. Waiting for 60 seconds...")
-            time.sleep(60)
-            continue
-        response.raise_for_status()
-        return response.json()
+# Number of brewery_id updates written and committed per batch
+BATCH_SIZE = 200
 
-# Update brewery_id for a beer in the database
-def update_brewery_id(cursor, beer_id, brewery_id):
+# Update brewery_id for a batch of (beer_id, brewery_id) pairs in a single statement
+def update_brewery_ids(cursor, pairs):
     query = """
     UPDATE beers
-    SET brewery_id = %s
-    WHERE beer_id = %s;
+    SET brewery_id = v.brewery_id
+    FROM (VALUES %s) AS v (beer_id, brewery_id)
+    WHERE beers.beer_id = v.beer_id;
     """
-    cursor.execute(query, (brewery_id, beer_id))
+    if execute_values is None:
+        mogrify_values(cursor, query, pairs, "(%s, %s)")
+    else:
+        execute_values(cursor, query, pairs, template="(%s, %s)", page_size=BATCH_SIZE)
 
 # Main function to populate brewery_id in beers table
 def main():
+    logging.basicConfig(level=logging.INFO)
     print("Starting the script...")
     
     # Load configuration
     config = load_config()
+    configure_sessions(config["api"])
 
     # Connect to the database
     print("Connecting to database...")
     connection = psycopg2.connect(**config["database"])
+    connection.autocommit = False  # updates are grouped into BATCH_SIZE transactions
     cursor = connection.cursor()
     print("Connected to database successfully.")
 
     try:
-        # Fetch all beers from the database
-        cursor.execute("SELECT beer_id FROM beers WHERE brewery_id IS NULL;")
-        beers_to_update = cursor.fetchall()
-        print(f"Found {len(beers_to_update)} beers to update.")
+        # Stream beers from the database with a server-side cursor. WITH HOLD keeps it open
+        # across the batch commits below; updates go through the regular cursor.
+        with connection.cursor(name="beers_to_update", withhold=True) as beers_cursor:
+            beers_cursor.itersize = 2000
+            beers_cursor.execute("SELECT beer_id FROM beers WHERE brewery_id IS NULL;")
 
-        # Iterate through beers and fetch brewery_id
-        for beer_id, in tqdm(beers_to_update, desc="Updating Brewery IDs"):
-            try:
-                # Fetch beer details from the API
-                beer_details = fetch_beer_details(config["api"], beer_id)["response"]["beer"]
-                brewery_id = beer_details["brewery"]["brewery_id"]
+            # Fetch beer details concurrently, one chunk at a time, through beer_database's generator
+            # (shared session and rate limiter; failed fetches are logged and skipped, and pending
+            # fetches are cancelled if anything below fails). Database updates stay on this thread.
+            updated = 0
+            pairs = []
+            with tqdm(desc="Updating Brewery IDs") as progress:
+                while True:
+                    chunk = beers_cursor.fetchmany(beers_cursor.itersize)
+                    if not chunk:
+                        break
 
-                # Update the brewery_id in the database
-                update_brewery_id(cursor, beer_id, brewery_id)
-                connection.commit()
+                    # Iterate through beers and collect their brewery_id
+                    for beer_id, response in fetch_all_beer_details(config["api"], [beer_id for beer_id, in chunk]):
+                        progress.update()
+                        if response is None:
+                            continue
+                        try:
+                            brewery_id = response["response"]["beer"]["brewery"]["brewery_id"]
+                        except (KeyError, TypeError) as e:
+                            # A malformed response only costs this beer; the next run fetches it again
+                            logger.warning("Error processing beer_id %s: %s", beer_id, e)
+                            continue
+                        pairs.append((beer_id, brewery_id))
 
-            except Exception as e:
-                print(f"Error processing beer_id {beer_id}: {e}")
-                connection.rollback()
+                        # Update brewery_ids in the database in batches
+                        if len(pairs) >= BATCH_SIZE:
+                            update_brewery_ids(cursor, pairs)
+                            connection.commit()
+                            updated += len(pairs)
+                            pairs = []
 
-        print("Brewery IDs updated successfully.")
+        if pairs:
+            update_brewery_ids(cursor, pairs)
+            updated += len(pairs)
+
+        connection.commit()
+        print(f"Brewery IDs updated successfully for {updated} beers.")
 
     except Exception as e:
         print(f"Error: {e}")